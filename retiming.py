@@ -1,133 +1,464 @@
+import argparse
+import array
+import re
+import sys
+
 import numpy as np
 
+# Numba is optional. Without it the Floyd-Warshall pass falls back to
+# the vectorized NumPy version below
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+# CuPy is optional too. When present, very large graphs run on the GPU
+try:
+    import cupy as cp
+except ImportError:
+    cp = None
+
+# Value used for "no path between the two nodes". Tied to the int32
+# matrices: half of the largest int32, so no real path sum reaches it
+# and INF + INF still fits
+INF = np.iinfo(np.int32).max >> 1
+
+
+def _fw_pivot(matrix, k, through_k):
+    """
+    Relax every (i,j) through pivot k at once: column k + row k broadcast
+
+    Rows with no path into k cannot improve through k, so when there are
+    any only the other rows are gathered, relaxed and written back.
+    through_k is a scratch array shaped like matrix, owned by the caller
+    so it is allocated once per Floyd-Warshall run
+    """
+    row = matrix[None, k, :]
+    # A path through k only exists if both halves of it exist. Every row
+    # relaxed below has a path into k, so only row k needs checking
+    row_finite = row < INF
+    rows = np.flatnonzero(matrix[:, k] < INF)
+    if rows.size < matrix.shape[0]:
+        reachable = matrix[rows]
+        partial = np.add(reachable[:, k, None], row,
+                         out=through_k[:rows.size])
+        np.minimum(reachable, partial, out=reachable, where=row_finite)
+        matrix[rows] = reachable
+    else:
+        np.add(matrix[:, k, None], row, out=through_k)
+        np.minimum(matrix, through_k, out=matrix, where=row_finite)
+
+
+def _fw_numpy(matrix):
+    """
+    Floyd-Warshall with NumPy broadcasting
+
+    The pivots are the columns, so a matrix with extra rows (sources
+    that no edge points back into) works as well
+    """
+    through_k = np.empty_like(matrix)
+    for k in range(matrix.shape[1]):
+        _fw_pivot(matrix, k, through_k)
+
+
+def _fw_generations(matrix, ks):
+    """
+    Floyd-Warshall one pivot at a time, only used for display
+
+    Relaxes matrix in place and returns a 3D array with a copy of it
+    taken right after each pivot in ks
+    """
+    ks = set(ks)
+    generations = []
+    through_k = np.empty_like(matrix)
+    for k in range(matrix.shape[1]):
+        _fw_pivot(matrix, k, through_k)
+        if k in ks:
+            generations.append(np.copy(matrix))
+
+    return np.array(generations)
+
+
+def _fw_python(matrix):
+    """
+    Floyd-Warshall on plain Python lists
+
+    Row k and row i are bound once per loop so the inner loop does a
+    single list lookup per operand. Rows with no path into k are skipped
+    """
+    rows = matrix.tolist()
+    for k in range(len(rows[0])):
+        row_k = rows[k]
+        for row_i in rows:
+            w_ik = row_i[k]
+            if w_ik >= INF:
+                continue
+            for j, w_kj in enumerate(row_k):
+                v = w_ik + w_kj
+                if v < row_i[j] and w_kj < INF:
+                    row_i[j] = v
+    matrix[...] = rows
+
+
+def _fw_cupy(matrix):
+    """
+    Floyd-Warshall on the GPU with CuPy
+
+    Same pivot step as _fw_pivot, the matrix is copied over once and back
+    """
+    gpu_matrix = cp.asarray(matrix)
+    for k in range(gpu_matrix.shape[1]):
+        col = gpu_matrix[:, k, None]
+        row = gpu_matrix[None, k, :]
+        through_k = cp.where((col < INF) & (row < INF), col + row, INF)
+        cp.minimum(gpu_matrix, through_k, out=gpu_matrix)
+    matrix[...] = cp.asnumpy(gpu_matrix)
+
+
+if njit is not None:
+    # Every kernel is compiled for C-contiguous int32 matrices only. The
+    # explicit signatures compile them once on import and cache=True keeps
+    # the compiled code on disk, so later runs skip the JIT entirely
+    @njit('void(int32[:,::1], int64)', parallel=True, cache=True,
+          boundscheck=False)
+    def _fw_numba(matrix, inf):
+        """
+        Floyd-Warshall compiled with Numba
+
+        k carries a dependency so only the rows (i) are split across threads.
+        The j loop walks row k and row i contiguously, and rows with no path
+        into k are skipped as a whole
+        """
+        rows, n = matrix.shape
+        for k in range(n):
+            row_k = matrix[k]
+            for i in prange(rows):
+                row_i = matrix[i]
+                w_ik = row_i[k]
+                if w_ik >= inf:
+                    continue
+                for j in range(n):
+                    v = w_ik + row_k[j]
+                    if v < row_i[j] and row_k[j] < inf:
+                        row_i[j] = v
+
+    @njit('void(int32[:,::1], int64)', parallel=True, cache=True,
+          boundscheck=False)
+    def _fw_sparse(matrix, inf):
+        """
+        Floyd-Warshall that only visits pairs that can use pivot k
+
+        Rows with no path into k and columns with no path out of k
+        can never be improved through k, so they are skipped
+        """
+        for k in range(matrix.shape[1]):
+            row_k = matrix[k]
+            rows = np.nonzero(matrix[:, k] < inf)[0]
+            cols = np.nonzero(row_k < inf)[0]
+            for r in prange(rows.size):
+                row_i = matrix[rows[r]]
+                w_ik = row_i[k]
+                for c in range(cols.size):
+                    j = cols[c]
+                    v = w_ik + row_k[j]
+                    if v < row_i[j]:
+                        row_i[j] = v
+
+    @njit('void(int32[:,:,::1], int64)', parallel=True, cache=True,
+          boundscheck=False)
+    def _fw_batch(stack, inf):
+        """
+        Floyd-Warshall on a stack of same-sized matrices at once
+
+        Every matrix in the stack is relaxed through the same pivot k
+        in one sweep, with the (matrix, row) pairs split across threads
+        """
+        batch, rows, n = stack.shape
+        for k in range(n):
+            for br in prange(batch * rows):
+                matrix = stack[br // rows]
+                row_k = matrix[k]
+                row_i = matrix[br % rows]
+                w_ik = row_i[k]
+                if w_ik >= inf:
+                    continue
+                for j in range(n):
+                    v = w_ik + row_k[j]
+                    if v < row_i[j] and row_k[j] < inf:
+                        row_i[j] = v
+
+
+# Stacks of up to this many nodes are relaxed in one batched sweep
+FW_BATCH_SIZE = 128
+
+# Without Numba, graphs up to this many nodes use the pure Python loop.
+# Past that NumPy's per-pivot call overhead is paid back
+FW_PYTHON_SIZE = 6
+
+# From this many nodes up the GPU is worth the copy to and from the device
+FW_GPU_SIZE = 1024
+
+# Below this fraction of finite entries the sparse kernel is used. On
+# denser matrices building the index lists costs more than it saves
+FW_SPARSE_DENSITY = 0.3
+
+
+def floyd_warshall(matrix):
+    """
+    Run Floyd-Warshall in place on a 2D matrix
+    
+    Returns the same matrix holding the shortest path between every pair.
+    The columns are the pivots, extra rows are allowed for source nodes
+    that nothing points back into
+    """
+
+    # The kernels want a C-contiguous int32 matrix so the inner j loop is
+    # a unit-stride walk. Anything else is relaxed on a copy and written back
+    work = np.ascontiguousarray(matrix, dtype=np.int32)
+
+    if cp is not None and work.shape[0] >= FW_GPU_SIZE:
+        _fw_cupy(work)
+    elif njit is None and work.shape[0] <= FW_PYTHON_SIZE:
+        _fw_python(work)
+    elif njit is None:
+        _fw_numpy(work)
+    elif np.count_nonzero(work < INF) < FW_SPARSE_DENSITY * work.size:
+        _fw_sparse(work, INF)
+    else:
+        _fw_numba(work, INF)
+
+    if work is not matrix:
+        matrix[...] = work
+    return matrix
+
+
+def floyd_warshall_batch(stack):
+    """
+    Run Floyd-Warshall in place on every matrix of a 3D stack
+
+    Small stacks go through one batched Numba sweep. Otherwise each
+    matrix takes the usual floyd_warshall() route
+    """
+    work = np.ascontiguousarray(stack, dtype=np.int32)
+    if njit is not None and work.shape[1] <= FW_BATCH_SIZE:
+        _fw_batch(work, INF)
+    else:
+        for matrix in work:
+            floyd_warshall(matrix)
+
+    if work is not stack:
+        stack[...] = work
+    return stack
+
+
+def _parse_delay_list(value):
+    """
+    Parse a comma separated list of delays straight into an int32 array
+    """
+    # fromstring quietly stops at a trailing comma, so also check that
+    # every comma separated entry made it into the array
+    try:
+        delays = np.fromstring(value, dtype=np.int32, sep=',')
+    except ValueError:
+        delays = None
+    if delays is None or delays.size != value.count(b',') + 1:
+        raise ValueError(f"Malformed NodeDelays list: "
+                         f"{value.decode(errors='replace')!r}")
+    return delays
+
+
+# Header keys in the circuit file: key -> (circuit_info field, converter)
+# The file is parsed as raw bytes, so the keys are bytes too
+HEADER_FIELDS = {
+    b'TotalNodes': ("total_nodes", int),
+    b'NodeDelays': ("node_delays", _parse_delay_list),
+    b'MaxClockCycle': ("max_clock_cycle", int),
+}
+
+# One pattern for every record in the circuit file, compiled once.
+# A line is either a header entry (key=value) or an edge entry
+# EdgeU_V=delay where U is the source node and V the sink. The short
+# form EdgeUV (no separator) is still accepted when both nodes are < 10.
+# Comments and empty lines simply never match. Any other line falls
+# through to the "bad" group so it can be reported instead of dropped
+# Only spaces and tabs are skipped inside a record so that none can run
+# on to the next line (\r is dropped too, for files with \r\n endings)
+CIRCUIT_PATTERN = re.compile(
+    rb'^(?:(?P<key>' + b'|'.join(HEADER_FIELDS) + rb')[ \t]*=[ \t]*(?P<value>\S.*?)'
+    rb'|Edge(?P<nodes>\d+_\d+|\d\d)[ \t]*=[ \t]*(?P<delay>-?\d+)'
+    rb'|(?P<bad>[ \t]*(?!//)\S.*?))[ \t\r]*$',
+    re.MULTILINE)
+
+
 def parse_circuit_file(file_path):
     """
     Parse the circuit file and extract relevant information.
     
     Returns dictionary with parsed information.
     """
-    with open(file_path, 'r') as file:
-        lines = file.readlines()
 
     # Dictionary to hold circuit information
     circuit_info = {
         "total_nodes": 0,
-        "node_delays": [],
-        "edge_delays": {},
-        "max_clock_cycle": 0
+        "node_delays": np.empty(0, dtype=np.int32),
+        "edge_src": np.empty(0, dtype=np.int32),
+        "edge_dst": np.empty(0, dtype=np.int32),
+        "edge_delay": np.empty(0, dtype=np.int32),
+        "max_clock_cycle": 0,
+        "max_node_delay": 0,
+        "m_value": 0
     }
 
-    for line in lines:
-        # Ignore comments and empty lines
-        if line.startswith('//') or line.strip() == '':
-            continue
-
-        # Split the line into key and value
-        key, value = line.split('=')
-        value = value.strip()  # Remove any leading/trailing whitespace
-
-        if key == 'TotalNodes':
-            circuit_info["total_nodes"] = int(value)
-        elif key == 'NodeDelays':
-            # Split the delays and convert them to integers
-            circuit_info["node_delays"] = list(map(int, value.split(',')))
-        elif key == 'MaxClockCycle':
-            circuit_info["max_clock_cycle"] = int(value)
+    # Read the raw bytes, there is no need to decode the file to str
+    with open(file_path, 'rb') as file:
+        text = file.read()
+
+    # Single regex pass over the whole file, branching on which
+    # group matched. Edges are stored as three parallel int32 buffers
+    # (source node, sink node, delay) filled in as they are parsed.
+    # Nodes are stored as array indices (node-1) so every matrix can
+    # scatter with them directly
+    edge_src = array.array('i')
+    edge_dst = array.array('i')
+    edge_delay = array.array('i')
+    for match in CIRCUIT_PATTERN.finditer(text):
+        bad = match.group('bad')
+        if bad is not None:
+            raise ValueError(f"Unrecognized line in {file_path}: "
+                             f"{bad.decode(errors='replace').strip()!r}")
+        key = match.group('key')
+        if key is not None:
+            field, convert = HEADER_FIELDS[key]
+            circuit_info[field] = convert(match.group('value'))
         else:
-            # If key doesn't match any of of the options above, this must
-            # be an edge delay entry. Parse the edge's name and delay value
-            edge_name = key
-            edge_delay = int(value)
-            circuit_info["edge_delays"][edge_name] = edge_delay
+            nodes = match.group('nodes')
+            src, sep, dst = nodes.partition(b'_')
+            if not sep:
+                src, dst = nodes[:1], nodes[1:]
+            edge_src.append(int(src)-1)
+            edge_dst.append(int(dst)-1)
+            edge_delay.append(int(match.group('delay')))
+
+    # View the buffers as NumPy arrays without copying them
+    circuit_info["edge_src"] = np.frombuffer(edge_src, dtype=np.int32)
+    circuit_info["edge_dst"] = np.frombuffer(edge_dst, dtype=np.int32)
+    circuit_info["edge_delay"] = np.frombuffer(edge_delay, dtype=np.int32)
+
+    # One delay per node, and every edge has to connect two of the
+    # TotalNodes nodes
+    size = circuit_info["total_nodes"]
+    if circuit_info["node_delays"].size != size:
+        raise ValueError(f"{file_path} lists "
+                         f"{circuit_info['node_delays'].size} node delays "
+                         f"for {size} nodes")
+    for src, dst in zip(edge_src, edge_dst):
+        if not (0 <= src < size and 0 <= dst < size):
+            raise ValueError(f"Edge{src+1}_{dst+1} in {file_path} is outside "
+                             f"the {size} nodes of the circuit")
+
+    # Max node delay and M = N * max(d) are used by several of the
+    # matrices below, so work them out once here
+    node_delay = circuit_info["node_delays"]
+    if node_delay.size:
+        circuit_info["max_node_delay"] = int(node_delay.max())
+    circuit_info["m_value"] = (circuit_info["total_nodes"]
+                               * circuit_info["max_node_delay"])
 
     return circuit_info
 
-def create_wmatrix(circuit_info):
+def _init_wmatrix(circuit_info):
     """
-    Create initial W Matrix
-    
-    Populate matrix with edge weights from circuit info
+    Initial W Matrix
+
+    Only the direct edges are filled in, no paths have been relaxed yet
     """
 
-    # Create a 3D array with 3 dimensions equal to the number of nodes
-    # Populate this 3D array with a high number as initial value (9999)
+    # Create a 2D array with both dimensions equal to the number of nodes
+    # Populate this 2D array with a high number as initial value (INF)
     # This default value represents no path between the two nodes
     size = circuit_info.get("total_nodes")
-    shape = (size,size,size)
-    fill_value = 9999
-    w_matrix = np.full(shape,fill_value)
+    shape = (size,size)
+    fill_value = INF
+    w_matrix = np.full(shape,fill_value,dtype=np.int32)
 
     # All elements where row == col should be zero
     # U==V -> W(u,v)==0
-    for e in range(size):
-        for n in range(size):
-            w_matrix[e,n,n] = 0
-
-    # Modify elements in w-matrix using "edge_delays" dictionary in circuit_info
-    # Access using edge_name as key and edge_delay as the value. 
-    # edge_name ends in two integers: first=row, second=col 
-    for edge_name, edge_delay in circuit_info["edge_delays"].items():
-    
-        # First four characters are always the same, 'Edge'
-        # Arrays start from 0. Row = (node-1) and Col = (node-1)
-        i, j = map(int, edge_name[4:])
-        for e in range(size):
-            w_matrix[e,i-1,j-1] = edge_delay
-
-    # Parameterized the algorithm by adding a 3rd dimension to my array
-    # e represents the maximum number of edges considered in any given path
-    for e in range(1,size):
-        for r in range(size):
-            for c in range(size):
-                not_c = list(range(0,c))+list(range(c+1,size))
-                for i in not_c:
-                        if (w_matrix[e-1,r,i] + w_matrix[e-1,i,c]) < w_matrix[e,r,c]:
-                            w_matrix[e,r,c] = (w_matrix[e-1,r,i] + w_matrix[e-1,i,c]) 
-                        else:
-                            w_matrix[e,r,c]=w_matrix[e,r,c]
-    
+    np.fill_diagonal(w_matrix,0)
+
+    # Scatter the edge delays into the w-matrix in one go
+    src, dst = circuit_info["edge_src"], circuit_info["edge_dst"]
+    w_matrix[src,dst] = circuit_info["edge_delay"]
+
     return w_matrix
 
 
-def create_gpmatrix(circuit_info):
+def wmatrix_generations(circuit_info, ks):
+    """
+    Rebuild the intermediate W Matrices, only used for display
+    
+    Returns a 3D array with a copy of W taken right after each pivot in ks
+    """
+    return _fw_generations(_init_wmatrix(circuit_info), ks)
+
+
+def _init_gpmatrix(circuit_info):
     """
-    Create G-Prime Matrix
+    Initial G-Prime Matrix
     
     Populate initial matrix using w'(e)=m*w(e)-d(u)
     """
     
-    # Create a 3D array with 3 dimensions equal to the number of nodes
-    # Populate this 3D array with a high number as initial value (9999)
+    # Create a 2D array with both dimensions equal to the number of nodes
+    # Populate this 2D array with a high number as initial value (INF)
     # This default value represents no path between the two nodes
     size = circuit_info.get("total_nodes")
-    shape = (size,size,size)
-    fill_value = 9999
-    gp_matrix = np.full(shape,fill_value)
+    shape = (size,size)
+    fill_value = INF
+    gp_matrix = np.full(shape,fill_value,dtype=np.int32)
 
     # Initialize gp-matrix using edge_delays, node_delays and M 
+    # Worked out in int64, int32 * int32 would wrap around silently
     node_delay = circuit_info.get("node_delays")
-    m_value = size * max(node_delay)
-    for edge_name, edge_delay in circuit_info["edge_delays"].items():
-    
-        i, j = map(int, edge_name[4:])
-        for e in range(size):
-            gp_matrix[e,i-1,j-1] = m_value * edge_delay - node_delay[i-1]
- 
-    # Parameterized the algorithm by adding a 3rd dimension to my array
-    # e represents the maximum number of edges considered in any given path
-    for e in range(1,size):
-        for r in range(size):
-            for c in range(size):
-                not_c = list(range(0,c))+list(range(c+1,size))
-                for i in not_c:
-                        if (gp_matrix[e-1,r,i] + gp_matrix[e-1,i,c]) < gp_matrix[e,r,c]:
-                            gp_matrix[e,r,c] = (gp_matrix[e-1,r,i] + gp_matrix[e-1,i,c]) 
-                        else:
-                            gp_matrix[e,r,c]=gp_matrix[e,r,c]
-    
+    m_value = circuit_info.get("m_value")
+    src, dst = circuit_info["edge_src"], circuit_info["edge_dst"]
+    weights = (m_value * circuit_info["edge_delay"].astype(np.int64)
+               - node_delay[src])
+
+    # A path has fewer than size edges, so every path sum has to stay
+    # clear of INF or it would be taken for "no path"
+    if weights.size and np.abs(weights).max() * size >= INF:
+        raise ValueError("Circuit delays are too large: w'(e)=m*w(e)-d(u) "
+                         "path sums would reach the int32 no-path value")
+    gp_matrix[src,dst] = weights
+
     return gp_matrix
 
 
+def create_wgp_matrices(circuit_info):
+    """
+    Create the W and G-Prime Matrices together
+
+    W is the shortest path W(u,v) over the edge weights, G' the shortest
+    path over the w'(e)=m*w(e)-d(u) weights. Both are plain shortest paths
+    over the same graph, so their initial matrices are stacked and
+    relaxed in a single Floyd-Warshall sweep
+    """
+    stack = np.stack([_init_wmatrix(circuit_info),
+                      _init_gpmatrix(circuit_info)])
+    floyd_warshall_batch(stack)
+
+    return stack[0], stack[1]
+
+
+def gpmatrix_generations(circuit_info, ks):
+    """
+    Rebuild the intermediate G-Prime Matrices, only used for display
+    
+    Returns a 3D array with a copy of G' taken right after each pivot in ks
+    """
+    return _fw_generations(_init_gpmatrix(circuit_info), ks)
+
+
 def create_dmatrix(circuit_info, w_matrix, gp_matrix):
     """
     Create D Matrix
@@ -135,111 +466,63 @@ def create_dmatrix(circuit_info, w_matrix, gp_matrix):
     Populate matrix using D(u,v)=m*W(u,v)-G'(u,v)+d(v) 
     """
     
-    # Create a 3D array with 3 dimensions equal to the number of nodes
-    # Populate this 3D array with a high number as initial value (9999)
-    # This default value represents no path between the two nodes
-    size = circuit_info.get("total_nodes")
-    shape = (size,size)
-
-    # Initialize d-matrix 
-    # All elements where row == col should be zero
-    # U==V -> W(u,v)==0
-    fill_value = 9999
-    d_matrix = np.full(shape,fill_value)
-
+    # Pairs with no path in W keep INF, the "no path" value. The rest are
+    # worked out in int64 so m*W cannot overflow before the subtraction
     node_delay = circuit_info.get("node_delays")
-    m_value = size * max(node_delay)
-    for i in range(size):
-        for j in range(size):
-            if i != j:
-                d_matrix[i-1,j-1] = m_value * w_matrix[i-1,j-1] - gp_matrix[i-1,j-1] + node_delay[j-1]
-            else:
-                d_matrix[i-1,j-1] = node_delay[i-1]
+    m_value = circuit_info.get("m_value")
+    has_path = w_matrix < INF
+    d_values = (m_value * w_matrix.astype(np.int64) - gp_matrix
+                + node_delay[None,:])
+    if np.any(np.abs(d_values[has_path]) >= INF):
+        raise ValueError("Circuit delays are too large: D(u,v) would reach "
+                         "the int32 no-path value")
+    d_matrix = np.where(has_path, d_values, INF).astype(np.int32)
+
+    # D(v,v) is just the delay of node v
+    np.fill_diagonal(d_matrix,node_delay)
 
     return d_matrix
 
 
-def ineq_matrix(circuit_info, w_matrix, d_matrix):
+def ineq_matrix(circuit_info):
     """
-    Create and Print Inequalities
+    Create the initial set of inequalities, r(u) - r(v) <= w(e) for
+    every edge e from u to v
+
+    The sets for each clock period are nested (a smaller c only adds
+    pairs), so reduced_ineq adds the ones for the desired c on top of
+    this set directly rather than keeping one layer per c value
     """
     
+    # Create a 2D array with both dimensions equal to the number of nodes
+    # Populate this 2D array with a high number as initial value (INF)
+    # This default value represents no inequality between the two nodes
     size = circuit_info.get("total_nodes")
-    c_value = circuit_info.get("max_clock_cycle")
-    node_delay = circuit_info.get("node_delays")
-
-
-
-    # Create a 3D array with 3 dimensions equal to the number of nodes
-    # Populate this 3D array with a high number as initial value (9999)
-    # This array will be used to store the sets of inequalites created 
-    # 1 axis will represent each new set of inequalites
-    ineq_sets = c_value-max(node_delay)+2
-    shape = (ineq_sets,size,size)
-    fill_value = 9999
-    ineq_matrix = np.full(shape,fill_value)
-
+    shape = (size,size)
+    fill_value = INF
+    ineq_matrix = np.full(shape,fill_value,dtype=np.int32)
 
-    # Store the inequalities in a 3D array with the initial set 
-    # of inequalities as layer/generation 0 and then each new layer
-    # representing inequalites for our decrementing c_value
-    for edge_name, edge_delay in circuit_info["edge_delays"].items():
-    
-        # First four characters are always the same, 'Edge'
-        i, j = map(int, edge_name[4:])
-        ineq_matrix[0,i-1,j-1] = edge_delay
-
-
-    # Compare D and W matrices to create each new set of inequalities
-    # Decrement c & repeat while c >= max node delay in our circuit
-    # Store each new matrix as a new layer/generation along axis 0
-    g = 1
-    while c_value >= max(node_delay):
-        for i in range(size):
-            for j in range(size):
-                if d_matrix[i,j] > c_value:
-                    ineq_matrix[g,i,j] = w_matrix[i,j]-1
-                else:
-                    continue
-        g = g + 1
-        c_value = c_value-1
-    
+    src, dst = circuit_info["edge_src"], circuit_info["edge_dst"]
+    ineq_matrix[src,dst] = circuit_info["edge_delay"]
 
     return ineq_matrix
 
 
-def reduced_ineq(circuit_info, ineq_matrix, new_c_value):
+def reduced_ineq(circuit_info, ineq_matrix, w_matrix, d_matrix, new_c_value):
     """
-    Takes matrix of all sets of inequalities from initial set down to
-    the desired max clock cylce and compiles them in to a single matrix, 
+    Takes the initial set of inequalities and adds the ones needed for
+    the desired max clock cylce, compiling them in to a single matrix, 
     removing ay redundancies
     """
- 
-    size = circuit_info.get("total_nodes")
-    c_value = circuit_info.get("max_clock_cycle")
-    node_delay = circuit_info.get("node_delays")
-
-
-
-    # Create a 2D array with 2 dimensions equal to the number of nodes
-    # Populate this 2D array with a high number as initial value (9999)
-    # This array will be used remove redundant inequalites
-    sets_to_reduce = c_value - new_c_value + 2
-    shape = (size,size)
-    fill_value = 9999
-    reduced_ineq = np.full(shape,fill_value)
-
 
+    # Period new_c needs r(u) - r(v) <= W(u,v)-1 for every pair with
+    # D(u,v) > new_c, whatever the circuit's own MaxClockCycle is
+    over_c = (d_matrix > new_c_value) & (w_matrix < INF)
+    clock_ineq = np.where(over_c, w_matrix-1, INF)
 
-
-    # Compare cells across one axis to reduce/remove redundant ineq
-    for g in range(sets_to_reduce):
-        for r in range(size):
-            for c in range(size):
-                if ineq_matrix[g,r,c] < reduced_ineq[r,c]:
-                    reduced_ineq[r,c] = ineq_matrix[g,r,c] 
-                else:
-                    continue 
+    # Compare cells across both sets to reduce/remove redundant ineq
+    # The tightest bound for each pair is the min of the two
+    reduced_ineq = np.minimum(ineq_matrix, clock_ineq)
     
 
     # Display our reduced set of inequalities
@@ -247,198 +530,243 @@ def reduced_ineq(circuit_info, ineq_matrix, new_c_value):
     print(f"      Reduced Set of Inequalities       ")
     print("----------------------------------------")
     
-    for k in range(size):
-        for l in range(size):
-            if reduced_ineq[k,l] != 9999:
-                print(f"r({k+1}) - r({l+1}) <= {reduced_ineq[k,l]}")
-            else:
-                continue
+    rows, cols = np.nonzero(reduced_ineq != INF)
+    bounds = reduced_ineq[rows, cols]
+    print("\n".join(f"r({k+1}) - r({l+1}) <= {v}"
+                    for k, l, v in zip(rows.tolist(), cols.tolist(),
+                                       bounds.tolist())))
 
     return reduced_ineq
 
 
 
-def constraint_graph(circuit_info,ineq_matrix):
+def _init_constraint_matrix(circuit_info,ineq_matrix):
     """
-    Represent constraint graph with a matrix
+    Initial constraint graph matrix
     Constraint graph has one additional node
     Populate matrix from ineq_matrix but swap U <=> V
     """
 
-    # Trying with only 1 dimensions equal to the number of nodes+1
+    # One row per node plus an extra row for the added node
     size = circuit_info.get("total_nodes")
-    shape = (size,size+1,size)
-    fill_value = 9999
-    constraint_matrix = np.full(shape,fill_value)
-
+    shape = (size+1,size)
+    fill_value = INF
+    constraint_matrix = np.full(shape,fill_value,dtype=np.int32)
 
-    # Fill all layers with cells from ineq_matrix, switching U and V
     # Fill the extra row with 0s
-    for g in range(size):
- 
-        for n in range(size):
-            constraint_matrix[g,size,n] = 0
-
-        for i in range(size):
-            for j in range(size):
-                constraint_matrix[g,i,j] = ineq_matrix[j,i]
-
-    # Parameterized the algorithm by adding a 3rd dimension to my array
-    # g represents the each generation of matrix the algorithm creates
-    for g in range(1,size):
-        for r in range(size+1):
-            for c in range(size):
-                not_c = list(range(0,c))+list(range(c+1,size))
-                for i in not_c:
-                        if (constraint_matrix[g-1,r,i] + constraint_matrix[g-1,i,c]) < constraint_matrix[g,r,c]:
-                            constraint_matrix[g,r,c] = (constraint_matrix[g-1,r,i] + constraint_matrix[g-1,i,c]) 
-                        else:
-                            constraint_matrix[g,r,c]=constraint_matrix[g,r,c]
+    constraint_matrix[size,:] = 0
+
+    # Fill with cells from ineq_matrix, switching U and V
+    constraint_matrix[:size] = ineq_matrix.T
+
+    return constraint_matrix
+
+
+def constraint_graph(circuit_info,ineq_matrix):
+    """
+    Represent constraint graph with a matrix
     
+    Shortest paths from every node, and from the additional node
+    """
+    constraint_matrix = _init_constraint_matrix(circuit_info,ineq_matrix)
+
+    # Floyd-Warshall: only the original nodes are pivots, nothing
+    # points back into the extra node
+    floyd_warshall(constraint_matrix)
+
     return constraint_matrix
 
+
+def constraint_generations(circuit_info, ineq_matrix, ks):
+    """
+    Rebuild the intermediate constraint matrices, only used for display
+    
+    Returns a 3D array with a copy taken right after each pivot in ks
+    """
+    return _fw_generations(_init_constraint_matrix(circuit_info,ineq_matrix), ks)
+
 def retimed_circuit_file(circuit_info, new_c_value, retimed_matrix, new_file_path):
 
     size = circuit_info.get("total_nodes") 
+
+    # Build the whole file as a list of pieces and write it in one go
+    # Write the total number of nodes
+    parts = ["// Specifies the total number of nodes in the graph\n",
+             f"TotalNodes={size}\n\n"]
+
+    # Write the delays for each node
+    node_delays = ','.join(map(str, circuit_info['node_delays']))
+    parts += ["// Specifies the delay for each node in the graph\n",
+              f"NodeDelays={node_delays}\n\n"]
+
+    # Write the delays for each edge
+    # Node numbers only need the U_V separator once they reach 10
+    parts.append("// Specifies the delay for each edge between nodes in the graph\n")
+    sep = '_' if size >= 10 else ''
+    src, dst = circuit_info['edge_src'], circuit_info['edge_dst']
+    parts += [f"Edge{i+1}{sep}{j+1}={delay}\n"
+              for i, j, delay in zip(src.tolist(), dst.tolist(),
+                                     retimed_matrix[src, dst].tolist())]
+
+    # Write the maximum clock cycle
+    parts += ["\n// Specifies the maximum clock cycle for the algorithm\n",
+              f"MaxClockCycle={new_c_value}\n"]
+
     with open(new_file_path, 'w') as file:
-        # Write the total number of nodes
-        file.write("// Specifies the total number of nodes in the graph\n")
-        file.write(f"TotalNodes={size}\n\n")
-        
-        # Write the delays for each node
-        file.write("// Specifies the delay for each node in the graph\n")
-        node_delays = ','.join(map(str, circuit_info['node_delays']))
-        file.write(f"NodeDelays={node_delays}\n\n")
-        
-        # Write the delays for each edge
-        file.write("// Specifies the delay for each edge between nodes in the graph\n")
-        for edge, delay in circuit_info['edge_delays'].items():
-            i, j = map(int, edge[4:])
-            file.write(f"{edge}={retimed_matrix[i-1][j-1]}\n")
-        
-        # Write the maximum clock cycle
-        file.write("\n// Specifies the maximum clock cycle for the algorithm\n")
-        file.write(f"MaxClockCycle={new_c_value}\n")
+        file.write(''.join(parts))
     
     return
 
 
+def print_matrix(matrix):
+    """
+    Print a matrix one row per line, with "-" where there is no path
+
+    A 3D stack of generations is printed one generation at a time, each
+    under its own header
+    """
+    if matrix.ndim == 3:
+        for g, generation in enumerate(matrix):
+            print(f"Generation {g}")
+            print_matrix(generation)
+        return
+
+    cells = np.where(matrix < INF, matrix.astype(str), '-')
+    width = int(np.char.str_len(cells).max(initial=1))
+    print("\n".join(" ".join(cell.rjust(width) for cell in row)
+                    for row in cells.tolist()))
+
+
    
 # Run the thing and do the stuff 
 if __name__ == "__main__":
     
     #############################################################
     ## Usage:
+    ## python retiming.py [--input circuit.txt] [--output retimed.txt]
+    ##                    [--minimize (default) | --c C] [--retime]
+    ##                    [--verbose] [--show-gens]
     ## Path for our circuit file and for the retimed circuit file
-    file_path_txt = 'example_input.txt'
-    new_file_path = 'retimed_circuit.txt'
+    parser = argparse.ArgumentParser(description="Leiserson-Saxe retiming")
+    parser.add_argument('--input', '--file', dest='input',
+                        default='example_input.txt',
+                        help="circuit file to retime")
+    parser.add_argument('--output', default='retimed_circuit.txt',
+                        help="where --retime writes the retimed circuit")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--minimize', action='store_true',
+                        help="retime for the smallest clock period, the "
+                             "max node delay (the default)")
+    target.add_argument('--c', type=int,
+                        help="retime for this clock period instead")
+    parser.add_argument('--retime', action='store_true',
+                        help="apply the retiming vector and write --output")
+    parser.add_argument('--verbose', action='store_true',
+                        help="print the circuit info and every matrix")
+    parser.add_argument('--show-gens', action='store_true',
+                        help="print every matrix generation (implies "
+                             "--verbose)")
+    args = parser.parse_args()
+
+    file_path_txt = args.input
+    new_file_path = args.output
+    verbose = args.verbose or args.show_gens
     #############################################################
 
 
     parsed_info = parse_circuit_file(file_path_txt)
-    last_gen = parsed_info.get("total_nodes")-1
     c_value = parsed_info.get("max_clock_cycle")
-    node_delay = parsed_info.get("node_delays")
     size = parsed_info.get("total_nodes")
+
+    # No clock period can be shorter than the slowest node
+    if args.c is not None and (args.c <= 0 or
+                               args.c < parsed_info["max_node_delay"]):
+        parser.error(f"--c must be at least the max node delay "
+                     f"({parsed_info['max_node_delay']}), got {args.c}")
     
-    w_matrix = create_wmatrix(parsed_info)
-    gp_matrix = create_gpmatrix(parsed_info)
-    d_matrix = create_dmatrix(parsed_info,w_matrix[last_gen],gp_matrix[last_gen])
+    w_matrix, gp_matrix = create_wgp_matrices(parsed_info)
+    d_matrix = create_dmatrix(parsed_info,w_matrix,gp_matrix)
     
 
 
 
-
     # Will need to call inequalities matrix as well as contraing
     # matrix calculation here to help group items for readability
 
-    print("----------------------------------------")
-    print("          Initial Circuit Info          ")
-    print("----------------------------------------")
-    print(parsed_info)
-    print()
+    if verbose:
+        print("----------------------------------------")
+        print("          Initial Circuit Info          ")
+        print("----------------------------------------")
+        print(parsed_info)
+        print()
     
-    user_input = input("Would you like to see the matrix generations?(y/n)")
-    
-    print("----------------------------------------")
-    print("                W Matrix                ")
-    print("----------------------------------------")
-    if user_input == 'y':
-        print(w_matrix)
-    elif user_input == 'n':
-        print(w_matrix[last_gen])
-    else:
-        print("Invalid response, only displaying final gen by default")
-        print(w_matrix[last_gen])
+        print("----------------------------------------")
+        print("                W Matrix                ")
+        print("----------------------------------------")
+        if args.show_gens:
+            print_matrix(wmatrix_generations(parsed_info,range(size)))
+        else:
+            print_matrix(w_matrix)
 
-    print("----------------------------------------")
-    print("                W' Matrix               ")
-    print("----------------------------------------")
-    if user_input == 'y':
-        print(gp_matrix)
-    elif user_input == 'n':
-        print(gp_matrix[last_gen])
-    else:
-        print("Invalid response, only displaying final gen by default")
-        print(gp_matrix[last_gen])
+        print("----------------------------------------")
+        print("                W' Matrix               ")
+        print("----------------------------------------")
+        if args.show_gens:
+            print_matrix(gpmatrix_generations(parsed_info,range(size)))
+        else:
+            print_matrix(gp_matrix)
 
-    print("----------------------------------------")
-    print("                D Matrix                ")
-    print("----------------------------------------")
-    print(d_matrix)
+        print("----------------------------------------")
+        print("                D Matrix                ")
+        print("----------------------------------------")
+        print_matrix(d_matrix)
     
-    ineq_matrix = ineq_matrix(parsed_info,w_matrix[last_gen],d_matrix)
+    ineq_matrix = ineq_matrix(parsed_info)
 
     
 
-    # Would you like to miminimize the clock period or set a different c value
-    minimize = input("Would you like to minimize the clock period?(y/n)")
-    minimum_c = max(node_delay)
-    if minimize == 'y':
-        new_c_value = minimum_c
-        print(f"Minimizing circuit with c = {new_c_value}")
-    elif minimize == 'n':
-        new_c_value = int(input("What new c_value would you like to try?"))
-        print(f"Minimizing circuit with c = {new_c_value}")
+    # Miminimize the clock period (--minimize, the default) unless a
+    # different c value was given
+    if args.minimize or args.c is None:
+        new_c_value = parsed_info.get("max_node_delay")
     else:
-        new_c_value = minimum_c
-        print("Invalid response, minimizing circuit as default")
-        print(f"Minimizing circuit with c = {new_c_value}")
+        new_c_value = args.c
+    print(f"Minimizing circuit with c = {new_c_value}")
 
-    reduced_ineq = reduced_ineq(parsed_info,ineq_matrix,new_c_value)
+    reduced_ineq = reduced_ineq(parsed_info,ineq_matrix,w_matrix,d_matrix,
+                                new_c_value)
 
     constraint_matrix = constraint_graph(parsed_info,reduced_ineq)
     
-    print("----------------------------------------")
-    print("           Constraint Matrix            ")
-    print("----------------------------------------")
-    if user_input == 'y':
-        print(constraint_matrix)
-    elif user_input == 'n':
-        print(constraint_matrix[last_gen])
-    else:
-        print("Invalid response, only displaying final gen by default")
-        print(constraint_matrix[last_gen]) 
+    if verbose:
+        print("----------------------------------------")
+        print("           Constraint Matrix            ")
+        print("----------------------------------------")
+        if args.show_gens:
+            print_matrix(constraint_generations(parsed_info,reduced_ineq,range(size)))
+        else:
+            print_matrix(constraint_matrix)
     
+    # A negative cycle in the constraint graph means the inequalities
+    # contradict each other, so no retiming reaches this clock period
+    if np.any(np.diag(constraint_matrix[:size]) < 0):
+        print(f"c = {new_c_value} is infeasible, no retiming vector or "
+              f"circuit file created")
+        sys.exit(1)
+
     print("----------------------------------------")
     print("            Retiming Vector             ")
     print("----------------------------------------")
-    retiming_vector = constraint_matrix[last_gen][last_gen+1] 
+    retiming_vector = constraint_matrix[size]
     print(retiming_vector)
 
-    retimed_matrix = ineq_matrix[0]
-    retime = input("Would you like to use this retiming vector to create a new circuit file?(y/n)")
-    if retime == 'y':
-        for r in range(size):
-            for c in range(size):
-                if retimed_matrix[r,c] != 9999:
-                    retimed_matrix[r,c] = retimed_matrix[r,c] - retiming_vector[r]
-                if retimed_matrix[c,r] != 9999:
-                    retimed_matrix[c,r] = retimed_matrix[c,r] + retiming_vector[r]
+    retimed_matrix = ineq_matrix
+    if args.retime:
+        # Every edge u->v becomes w(e) + r(v) - r(u)
+        has_edge = retimed_matrix != INF
+        shift = retiming_vector[None,:] - retiming_vector[:,None]
+        retimed_matrix[has_edge] += shift[has_edge]
         retimed_circuit_file(parsed_info,new_c_value,retimed_matrix,new_file_path)
         print("Done! New Circuit File Created")
-    elif retime == 'n':
-        print("Not using retiming vector, ending scrip")
     else:
-        print("Invalid response, retiming vector ignored")
-
+        print("Not using retiming vector, ending script")